@@ -1,4 +1,5 @@
 import argparse
+import os
 import numpy as np
 
 import openmdao.api as om
@@ -7,15 +8,56 @@ from mphys.scenario_aerodynamic import ScenarioAerodynamic
 from adflow.mphys import ADflowBuilder
 from baseclasses import AeroProblem
 from pygeo.mphys import OM_DVGEOCOMP
+from pyoptsparse import History
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--task", default="run")
 parser.add_argument("--level", type=str, default="L1")
+parser.add_argument("--n2", action="store_true", help="write the n2 diagram of the model")
+parser.add_argument("--hotstart", action="store_true", help="replay the history file of a previous optimization")
+parser.add_argument("--verbose", action="store_true", help="list all model inputs and outputs after the run")
 args = parser.parse_args()
 
 
+class AvgCd(om.ExplicitComponent):
+    """
+    Average of the drag coefficients of the two cruise points.
+    The partials are constant, so they are declared once in setup.
+    """
+
+    def setup(self):
+        self.add_input("cd0")
+        self.add_input("cd1")
+        self.add_output("cd_out")
+
+        self.declare_partials("cd_out", "cd0", val=0.5)
+        self.declare_partials("cd_out", "cd1", val=0.5)
+
+    def compute(self, inputs, outputs):
+        outputs["cd_out"] = 0.5 * (inputs["cd0"] + inputs["cd1"])
+
+
 class Top(Multipoint):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        # builders and the surface meshes pulled from ADflow are kept across repeated setups
+        # so the grid is only read once
+        self.builders = {}
+        self._surface_cache = {}
+
+    def _get_builder(self, name, create_builder):
+        """
+        Create and initialize a builder the first time the model is set up
+        and reuse it for any later setup.
+        """
+        if name not in self.builders:
+            builder = create_builder()
+            builder.initialize(self.comm)
+            self.builders[name] = builder
+        return self.builders[name]
+
     def setup(self):
 
         ################################################################################
@@ -36,9 +78,9 @@ class Top(Multipoint):
             "smoother": "DADI",
             "CFL": 1.5,
             "CFLCoarse": 1.25,
-            "MGCycle": "sg",
-            "MGStartLevel": -1,
-            "nCyclesCoarse": 250,
+            "MGCycle": "3w",
+            "MGStartLevel": 3,
+            "nCyclesCoarse": 500,
             # ANK Solver Parameters
             "useANKSolver": True,
             "nsubiterturb": 5,
@@ -47,9 +89,25 @@ class Top(Multipoint):
             "ankinnerpreconits": 2,
             "ankouterpreconits": 2,
             "anklinresmax": 0.1,
+            # reuse the converged CFL when the same AeroProblem is re-solved in the next optimizer iteration
+            "ANKCFLReset": False,
+            "ANKLinearSolveBuffer": 0.5,
+            "ANKPCUpdateTolAfterCutoff": 1e-4,
+            # NK Solver Parameters
+            "useNKSolver": True,
+            "NKSwitchTol": 1e-8,
+            "NKSubspaceSize": 60,
+            "NKLinearSolveTol": 1e-2,
+            "NKUseEW": True,
+            # Adjoint Solver Parameters
+            # agglomerated multigrid preconditioning keeps the linear solves scalable on the finer meshes
+            "useAGMG": True,
+            "AGMGLevels": 3,
+            "AGMGNSmooth": 3,
             # Termination Criteria
             "L2Convergence": 1e-12,
-            "adjointl2convergence": 1e-12,
+            # loose to start with, InexactAdjointDriver tightens it as the optimization converges
+            "adjointl2convergence": 1e-6,
             "L2ConvergenceCoarse": 1e-2,
             # 'L2ConvergenceRel': 1e-4,
             "nCycles": 10000,
@@ -58,8 +116,7 @@ class Top(Multipoint):
             "forcesAsTractions": False,
         }
 
-        adflow_builder = ADflowBuilder(aero_options, scenario="aerodynamic")
-        adflow_builder.initialize(self.comm)
+        adflow_builder = self._get_builder("aero", lambda: ADflowBuilder(aero_options, scenario="aerodynamic"))
 
         ################################################################################
         # mphys setup
@@ -80,8 +137,8 @@ class Top(Multipoint):
         self.connect("mesh.x_aero0", "geometry.x_aero_in")
         self.connect("geometry.x_aero0", ["cruise0.x_aero", "cruise1.x_aero"])
 
-        # add an exec comp to average two drags
-        self.add_subsystem("drag", om.ExecComp("cd_out=(cd0+cd1)/2"))
+        # add a component to average two drags
+        self.add_subsystem("drag", AvgCd())
 
     def configure(self):
         # create the aero problems for both analysis point.
@@ -100,6 +157,8 @@ class Top(Multipoint):
         )
         ap1.addDV("alpha", value=aoa, name="aoa", units="deg")
 
+        # ADflow keeps the flow states of each AeroProblem, and restartADjoint is on by default,
+        # so reusing ap0 and ap1 already warm starts every re-solve from the previous iteration.
         # here we set the aero problems for every cruise case we have.
         # this can also be called set_flow_conditions, we don't need to create and pass an AP,
         # just flow conditions is probably a better general API
@@ -109,8 +168,13 @@ class Top(Multipoint):
         self.cruise1.coupling.mphys_set_ap(ap1)
         self.cruise1.aero_post.mphys_set_ap(ap1)
 
+        # fetch the surface data from ADflow only the first time the model is configured
+        if not self._surface_cache:
+            self._surface_cache["surf"] = self.mesh.mphys_get_surface_mesh()
+            self._surface_cache["tri"] = self.mesh.mphys_get_triangulated_surface()
+
         # create geometric DV setup
-        points = self.mesh.mphys_get_surface_mesh()
+        points = self._surface_cache["surf"]
 
         # add pointset
         self.geometry.nom_add_discipline_coords("aero", points)
@@ -118,7 +182,7 @@ class Top(Multipoint):
         # add these points to the geometry object
         # self.geo.nom_add_point_dict(points)
         # create constraint DV setup
-        tri_points = self.mesh.mphys_get_triangulated_surface()
+        tri_points = self._surface_cache["tri"]
         self.geometry.nom_setConstraintSurface(tri_points)
 
         # geometry setup
@@ -129,23 +193,21 @@ class Top(Multipoint):
 
         # Set up global design variables
         def twist(val, geo):
-            for i in range(1, nRefAxPts):
-                geo.rot_y["wing"].coef[i] = val[i - 1]
+            # coef has shape (nRefAxPts, 1), so fill its single column
+            geo.rot_y["wing"].coef[1:, 0] = val
 
-        self.geometry.nom_addGlobalDV(dvName="twist", value=np.array([0] * nTwist), func=twist)
+        self.geometry.nom_addGlobalDV(dvName="twist", value=np.zeros(nTwist), func=twist)
 
         # add dvs to ivc and connect
-        self.dvs.add_output("aoa0", val=aoa, units="deg")
-        self.dvs.add_output("aoa1", val=aoa, units="deg")
-        self.dvs.add_output("twist", val=np.array([0] * nTwist))
+        self.dvs.add_output("aoa", val=np.array([aoa, aoa]), units="deg")
+        self.dvs.add_output("twist", val=np.zeros(nTwist))
 
-        self.connect("aoa0", ["cruise0.coupling.aoa", "cruise0.aero_post.aoa"])
-        self.connect("aoa1", ["cruise1.coupling.aoa", "cruise1.aero_post.aoa"])
+        self.connect("aoa", ["cruise0.coupling.aoa", "cruise0.aero_post.aoa"], src_indices=[0])
+        self.connect("aoa", ["cruise1.coupling.aoa", "cruise1.aero_post.aoa"], src_indices=[1])
         self.connect("twist", "geometry.twist")
 
         # define the design variables
-        self.add_design_var("aoa0", lower=0.0, upper=10.0, scaler=0.1, units="deg")
-        self.add_design_var("aoa1", lower=0.0, upper=10.0, scaler=0.1, units="deg")
+        self.add_design_var("aoa", lower=0.0, upper=10.0, scaler=0.1, units="deg")
         self.add_design_var("twist", lower=-10.0, upper=10.0, scaler=0.01)
 
         # add constraints and the objective
@@ -158,13 +220,44 @@ class Top(Multipoint):
         self.add_objective("drag.cd_out", scaler=100.0)
 
 
+class InexactAdjointDriver(om.pyOptSparseDriver):
+    """
+    A pyOptSparse driver that tightens the ADflow adjoint convergence as the
+    optimization proceeds. The early iterations do not need gradients
+    converged to machine precision, so the adjoints are only solved tightly
+    once the optimizer is close to the optimum.
+
+    The schedule is a list of (gradient evaluation count, adjointl2convergence)
+    pairs; the number of gradient evaluations roughly follows the SNOPT major
+    iterations. Gradients replayed from a hot start file are not computed by
+    OpenMDAO, so they are not counted. Set gradient_count to the number of
+    replayed gradients to continue the schedule where the previous run left off.
+    """
+
+    def __init__(self, adjoint_tol_schedule, **kwargs):
+        super().__init__(**kwargs)
+        self.adjoint_tol_schedule = adjoint_tol_schedule
+        self.gradient_count = 0
+
+    def _compute_totals(self, *args, **kwargs):
+        # _compute_totals is private OpenMDAO API, but it is where pyOptSparseDriver
+        # computes every gradient, so it is the one place to update the tolerance
+        tol = [tol for count, tol in self.adjoint_tol_schedule if self.gradient_count >= count][-1]
+
+        model = self._problem().model
+        model.builders["aero"].solver.setOption("adjointl2convergence", tol)
+
+        self.gradient_count += 1
+        return super()._compute_totals(*args, **kwargs)
+
+
 ################################################################################
 # OpenMDAO setup
 ################################################################################
 prob = om.Problem()
 prob.model = Top()
 
-prob.driver = om.pyOptSparseDriver()
+prob.driver = InexactAdjointDriver(adjoint_tol_schedule=[(0, 1e-6), (10, 1e-8), (25, 1e-10), (50, 1e-12)])
 prob.driver.options["optimizer"] = "SNOPT"
 prob.driver.opt_settings = {
     "Major feasibility tolerance": 1e-4,  # 1e-4,
@@ -187,18 +280,32 @@ prob.driver.opt_settings = {
     "Penalty parameter": 1.0,
 }
 
+# store the optimization history. with --hotstart, the history of a previous run with the
+# same settings is replayed so the designs that were already evaluated do not run ADflow again
+prob.driver.hist_file = f"mphys_aero_2pt_{args.level}.hst"
+if args.hotstart and os.path.isfile(prob.driver.hist_file):
+    prob.driver.hotstart_file = prob.driver.hist_file
+
+    # the replayed gradients are not computed again, so continue the adjoint tolerance schedule after them
+    hist = History(prob.driver.hist_file)
+    prob.driver.gradient_count = sum("funcsSens" in hist.read(key) for key in hist.getCallCounters())
+    hist.close()
+
 # prob.driver.options['debug_print'] = ['totals', 'desvars']
 
 prob.setup(mode="rev")
-om.n2(prob, show_browser=False, outfile="mphys_aero_2pt.html")
+if args.n2:
+    om.n2(prob, show_browser=False, outfile="mphys_aero_2pt.html")
 
 if args.task == "run":
     prob.run_model()
 elif args.task == "opt":
     prob.run_driver()
 
-prob.model.list_inputs(units=True)
-prob.model.list_outputs(units=True)
+# listing the variables is collective, so every proc calls it. only the root proc prints
+if args.verbose:
+    prob.model.list_inputs(units=True)
+    prob.model.list_outputs(units=True)
 
 # prob.model.list_outputs()
 if prob.model.comm.rank == 0:
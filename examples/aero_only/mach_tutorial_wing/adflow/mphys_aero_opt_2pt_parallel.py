@@ -72,6 +72,9 @@ class ParallelCruises(MultipointParallel):
 
 class Top(om.Group):
     def setup(self):
+        # each cruise point needs its own procs, ADflow can not run two instances in the same process
+        if self.comm.size < 2:
+            raise SystemError("Please launch with at least 2 processors")
 
         ################################################################################
         # mphys setup
@@ -159,9 +162,10 @@ class Top(om.Group):
         self.add_design_var("aoa1", lower=0.0, upper=10.0, scaler=0.1, units="deg")
         # self.add_design_var("twist", lower=-10.0, upper=10.0, scaler=0.01)
 
-        # add constraints and the objective
-        self.add_constraint("mp.cruise0.aero_post.cl", equals=0.5, scaler=10.0)
-        self.add_constraint("mp.cruise1.aero_post.cl", equals=0.5, scaler=10.0)
+        # add constraints and the objective.
+        # the lift constraints share a color so their adjoints are solved in parallel
+        self.add_constraint("mp.cruise0.aero_post.cl", equals=0.5, scaler=10.0, parallel_deriv_color="cl_cons")
+        self.add_constraint("mp.cruise1.aero_post.cl", equals=0.5, scaler=10.0, parallel_deriv_color="cl_cons")
 
         # connect the two drags to drag average
         self.connect("mp.cruise0.aero_post.cd", "drag.cd0")
@@ -1,5 +1,6 @@
 # rst Imports
 from __future__ import print_function, division
+import argparse
 import numpy as np
 from mpi4py import MPI
 
@@ -13,8 +14,39 @@ from funtofem.mphys import MeldBuilder
 
 import tacs_setup
 
+parser = argparse.ArgumentParser()
+parser.add_argument("--n2", action="store_true", help="write the n2 diagram of the model")
+args = parser.parse_args()
+
+
+def get_coupling_solvers():
+    """
+    Create the coupling solvers of a scenario.
+    Each scenario needs its own solver instances, but all of them share the same settings.
+    """
+    solver_options = dict(maxiter=25, iprint=2, use_aitken=True, aitken_min_factor=0.1, aitken_max_factor=1.5,
+                          rtol=1e-8, atol=1e-8)
+    return om.NonlinearBlockGS(**solver_options), om.LinearBlockGS(**solver_options)
+
 
 class Top(Multipoint):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        # builders are kept across repeated setups so the meshes are only read once
+        self.builders = {}
+
+    def _get_builder(self, name, create_builder):
+        """
+        Create and initialize a builder the first time the model is set up
+        and reuse it for any later setup.
+        """
+        if name not in self.builders:
+            builder = create_builder()
+            builder.initialize(self.comm)
+            self.builders[name] = builder
+        return self.builders[name]
+
     def setup(self):
         # VLM
         mesh_file = "wing_VLM.dat"
@@ -25,8 +57,7 @@ class Top(Multipoint):
         vel = 178.0
         nu = 3.5e-5
 
-        aero_builder = VlmBuilder(mesh_file)
-        aero_builder.initialize(self.comm)
+        aero_builder = self._get_builder("aero", lambda: VlmBuilder(mesh_file))
 
         dvs = self.add_subsystem("dvs", om.IndepVarComp(), promotes=["*"])
         dvs.add_output("aoa", val=[aoa0, aoa1], units="deg")
@@ -38,23 +69,23 @@ class Top(Multipoint):
         self.add_subsystem("mesh_aero", aero_builder.get_mesh_coordinate_subsystem())
 
         # TACS setup
-        struct_builder = TacsBuilder(mesh_file="wingbox_Y_Z_flip.bdf", element_callback=tacs_setup.element_callback,
-                                     problem_setup=tacs_setup.problem_setup, coupled=True)
-        struct_builder.initialize(self.comm)
+        struct_builder = self._get_builder(
+            "struct",
+            lambda: TacsBuilder(mesh_file="wingbox_Y_Z_flip.bdf", element_callback=tacs_setup.element_callback,
+                                problem_setup=tacs_setup.problem_setup, coupled=True),
+        )
         ndv_struct = struct_builder.get_ndv()
 
         self.add_subsystem("mesh_struct", struct_builder.get_mesh_coordinate_subsystem())
 
-        dvs.add_output("dv_struct", np.array(ndv_struct * [0.002]))
+        dvs.add_output("dv_struct", np.full(ndv_struct, 0.002))
 
         # MELD setup
         isym = 1
-        ldxfer_builder = MeldBuilder(aero_builder, struct_builder, isym=isym)
-        ldxfer_builder.initialize(self.comm)
+        ldxfer_builder = self._get_builder("ldxfer", lambda: MeldBuilder(aero_builder, struct_builder, isym=isym))
 
         for iscen, scenario in enumerate(["cruise", "maneuver"]):
-            nonlinear_solver = om.NonlinearBlockGS(maxiter=25, iprint=2, use_aitken=True, rtol=1e-14, atol=1e-14)
-            linear_solver = om.LinearBlockGS(maxiter=25, iprint=2, use_aitken=True, rtol=1e-14, atol=1e-14)
+            nonlinear_solver, linear_solver = get_coupling_solvers()
             self.mphys_add_scenario(
                 scenario,
                 ScenarioAeroStructural(
@@ -79,7 +110,8 @@ prob = om.Problem()
 prob.model = Top()
 
 prob.setup()
-om.n2(prob, show_browser=False, outfile="mphys_as_vlm.html")
+if args.n2:
+    om.n2(prob, show_browser=False, outfile="mphys_as_vlm.html")
 
 prob.run_model()
 
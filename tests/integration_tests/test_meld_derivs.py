@@ -19,12 +19,27 @@ import openmdao.api as om
 from openmdao.utils.assert_utils import assert_near_equal
 
 from mphys import Builder
-from funtofem import TransferScheme
 from funtofem.mphys import MeldBuilder
 
 
 isym = 1
 
+# mesh sizes to test: a small one to check partials and a larger one to exercise the transfer
+_NNODES_SMALL = 4
+_NNODES_LARGE = 4096
+_NNODES = [_NNODES_SMALL, _NNODES_LARGE]
+
+# the test builds two transfer pipelines from the same MELD builder
+_COPIES = [1, 2]
+
+# fake node data, generated once. each pipeline gets its own random data so that
+# state leaking between the transfer instances through the shared MELD object is caught
+np.random.seed(0)
+_STRUCT_NODES = {(nnodes, copy): np.random.rand(3 * nnodes) for nnodes in _NNODES for copy in _COPIES}
+_STRUCT_DISPS = {nnodes: np.arange(3.0 * nnodes) for nnodes in _NNODES}
+_AERO_LOADS = {(nnodes, copy): np.random.rand(3 * nnodes) for nnodes in _NNODES for copy in _COPIES}
+_AERO_NODES = {(nnodes, copy): np.random.rand(3 * nnodes) for nnodes in _NNODES for copy in _COPIES}
+
 class DummyBuilder(Builder):
     def __init__(self, num_nodes, ndof):
         self.num_nodes = num_nodes
@@ -36,11 +51,15 @@ class DummyBuilder(Builder):
 
 class TestXferClasses(unittest.TestCase):
     def setUp(self):
+        self.prob = self._build_problem(_NNODES_SMALL)
+
+    def _build_problem(self, nnodes):
         class FakeStructMesh(om.ExplicitComponent):
             def initialize(self):
-                self.nodes = np.random.rand(12)
+                self.options.declare('copy')
 
             def setup(self):
+                self.nodes = _STRUCT_NODES[nnodes, self.options['copy']]
                 self.add_output('x_struct0', shape=self.nodes.size)
 
             def compute(self, inputs, outputs):
@@ -48,8 +67,7 @@ class TestXferClasses(unittest.TestCase):
 
         class FakeStructDisps(om.ExplicitComponent):
             def initialize(self):
-                self.nodes = np.random.rand(12)
-                self.nodes = np.arange(12)
+                self.nodes = _STRUCT_DISPS[nnodes]
 
             def setup(self):
                 self.add_output('u_struct', shape=self.nodes.size)
@@ -59,9 +77,10 @@ class TestXferClasses(unittest.TestCase):
 
         class FakeAeroLoads(om.ExplicitComponent):
             def initialize(self):
-                self.nodes = np.random.rand(12)
+                self.options.declare('copy')
 
             def setup(self):
+                self.nodes = _AERO_LOADS[nnodes, self.options['copy']]
                 self.add_output('f_aero', shape=self.nodes.size)
 
             def compute(self, inputs, outputs):
@@ -69,25 +88,25 @@ class TestXferClasses(unittest.TestCase):
 
         class FakeAeroMesh(om.ExplicitComponent):
             def initialize(self):
-                self.nodes = np.random.rand(12)
+                self.options.declare('copy')
 
             def setup(self):
+                self.nodes = _AERO_NODES[nnodes, self.options['copy']]
                 self.add_output('x_aero', shape=self.nodes.size)
 
             def compute(self, inputs, outputs):
                 outputs['x_aero'] = self.nodes
 
-        np.random.seed(0)
-        aero_builder = DummyBuilder(4,3)
-        struct_builder = DummyBuilder(4,3)
+        aero_builder = DummyBuilder(nnodes,3)
+        struct_builder = DummyBuilder(nnodes,3)
         meld_builder = MeldBuilder(aero_builder, struct_builder, isym=1, check_partials=True)
         meld_builder.initialize(MPI.COMM_WORLD)
 
         prob = om.Problem()
-        prob.model.add_subsystem('aero_mesh', FakeAeroMesh())
-        prob.model.add_subsystem('struct_mesh', FakeStructMesh())
+        prob.model.add_subsystem('aero_mesh', FakeAeroMesh(copy=1))
+        prob.model.add_subsystem('struct_mesh', FakeStructMesh(copy=1))
         prob.model.add_subsystem('struct_disps', FakeStructDisps())
-        prob.model.add_subsystem('aero_loads', FakeAeroLoads())
+        prob.model.add_subsystem('aero_loads', FakeAeroLoads(copy=1))
 
         disp, load = meld_builder.get_coupling_group_subsystem()
         prob.model.add_subsystem('disp_xfer',disp)
@@ -98,10 +117,10 @@ class TestXferClasses(unittest.TestCase):
         prob.model.connect('struct_disps.u_struct', ['disp_xfer.u_struct', 'load_xfer.u_struct'])
         prob.model.connect('aero_loads.f_aero', ['load_xfer.f_aero'])
 
-        prob.model.add_subsystem('aero_mesh2',FakeAeroMesh())
-        prob.model.add_subsystem('struct_mesh2',FakeStructMesh())
+        prob.model.add_subsystem('aero_mesh2',FakeAeroMesh(copy=2))
+        prob.model.add_subsystem('struct_mesh2',FakeStructMesh(copy=2))
         prob.model.add_subsystem('struct_disps2',FakeStructDisps())
-        prob.model.add_subsystem('aero_loads2',FakeAeroLoads())
+        prob.model.add_subsystem('aero_loads2',FakeAeroLoads(copy=2))
 
         disp, load = meld_builder.get_coupling_group_subsystem()
         prob.model.add_subsystem('disp_xfer2',disp)
@@ -112,27 +131,30 @@ class TestXferClasses(unittest.TestCase):
         prob.model.connect('struct_disps2.u_struct',['disp_xfer2.u_struct','load_xfer2.u_struct'])
         prob.model.connect('aero_loads2.f_aero',['load_xfer2.f_aero'])
 
-        prob.setup(force_alloc_complex=True)
-        self.prob = prob
+        prob.setup()
         #om.n2(prob, show_browser=False, outfile='test.html')
+        return prob
 
     def test_run_model(self):
         self.prob.run_model()
 
-    @unittest.skipUnless(TransferScheme.dtype == complex,
-                         "FunToFem must be compiled in complex mode.")
+    def test_run_model_large(self):
+        # only runs the transfer on a larger mesh, the partials are checked on the small one
+        prob = self._build_problem(_NNODES_LARGE)
+        prob.run_model()
+
     def test_derivatives(self):
         self.prob.run_model()
-        data = self.prob.check_partials(compact_print=True, method='cs')
+        data = self.prob.check_partials(compact_print=True, method='fd', step=1e-6)
 
         # there is an openmdao util to check partiales, but we can't use it
         # because only SOME of the fwd derivatives are implemented
         for key, comp in data.items():
             for var, err in comp.items():
                 rel_err = err['rel error']
-                assert_near_equal(rel_err.reverse, 0.0, 1e-12)
+                assert_near_equal(rel_err.reverse, 0.0, 1e-5)
                 if var[1] == 'f_aero' or var[1] == 'u_struct':
-                    assert_near_equal(rel_err.forward, 0.0, 1e-12)
+                    assert_near_equal(rel_err.forward, 0.0, 1e-5)
 
 
 if __name__ == '__main__':